@@ -10,21 +10,32 @@ import plotly.graph_objs as go
 import pandas as pd
 import os
 import time
+import threading
 from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from symptom_search import SymptomIndex
+from similar_cases import SimilarCaseIndex
 
 # สร้าง Flask app
 app = Flask(__name__)
 
 # ตั้งค่า logging
+# request thread แค่ใส่ record ลง queue ส่วนการเขียนไฟล์ (JSON lines) และหมุนไฟล์ทำใน background thread
 import logging
-from logging.handlers import RotatingFileHandler
+import atexit
+from queued_logging import LogPipeline
+log_pipeline = None
 if not app.debug:
-    file_handler = RotatingFileHandler('error.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    log_pipeline = LogPipeline(
+        os.environ.get('LOG_FILE', 'error.log'),
+        max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        rotate_interval=int(os.environ.get('LOG_ROTATE_INTERVAL', 86400)),
+        backup_count=int(os.environ.get('LOG_BACKUP_COUNT', 10)),
+        queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    )
+    log_pipeline.handler.setLevel(logging.INFO)
+    log_pipeline.start()
+    atexit.register(log_pipeline.stop)
+    app.logger.addHandler(log_pipeline.handler)
     app.logger.setLevel(logging.INFO)
     app.logger.info('Medical App startup')
 
@@ -36,6 +47,13 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['PROPAGATE_EXCEPTIONS'] = True  # เพื่อให้เห็น error details
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=60)  # Session timeout
 
+# กรณีที่คล้ายกันแสดงอาการ/ผลวินิจฉัยของผู้ป่วยคนอื่น จึงปิดไว้เป็นค่าเริ่มต้น
+# และเปิดให้เฉพาะบัญชีแพทย์ที่ระบุใน CLINICIAN_USERNAMES (คั่นด้วย ,)
+app.config['SIMILAR_CASES_ENABLED'] = os.environ.get('SIMILAR_CASES_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['CLINICIAN_USERNAMES'] = {
+    name.strip() for name in os.environ.get('CLINICIAN_USERNAMES', '').split(',') if name.strip()
+}
+
 def get_database_url():
     database_url = os.environ.get('DATABASE_URL')
     if database_url:
@@ -58,8 +76,10 @@ def configure_database():
 
     if database_url.startswith('postgresql://'):
         # ตั้งค่า connection pool สำหรับ PostgreSQL
+        # แต่ละ thread ของ worker (gthread) ใช้ได้หนึ่ง connection พร้อมกัน จึงตั้ง pool ตามจำนวน thread
+        pool_size = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 5)))
         app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-            'pool_size': 5,
+            'pool_size': pool_size,
             'max_overflow': 2,
             'pool_timeout': 30,
             'pool_recycle': 1800,
@@ -84,6 +104,8 @@ def configure_database():
 configure_database()
 
 # สร้าง instances
+# db.session เป็น scoped session ต่อ app context (หนึ่ง request ต่อหนึ่ง thread) และถูก remove ตอน teardown
+# current_user ก็เก็บแยกตาม request context จึงใช้กับ gthread worker ได้โดยไม่ต้องแชร์ state ระหว่าง thread
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
@@ -101,148 +123,156 @@ def fromjson_filter(value):
     except:
         return []
 
+# ชื่ออาการภาษาไทย (สร้างครั้งเดียวตอนโหลดโมดูล)
+SYMPTOM_LABELS = {
+    # อาการทั่วไป
+    'fever': 'มีไข้',
+    'fatigue': 'อ่อนเพลีย',
+    'weakness': 'อ่อนแรง',
+    'body_ache': 'ปวดเมื่อยตามตัว',
+    'night_sweats': 'เหงื่อออกตอนกลางคืน',
+    'weight_loss': 'น้ำหนักลด',
+    'weight_gain': 'น้ำหนักเพิ่ม',
+    'chills': 'หนาวสั่น',
+    'poor_appetite': 'เบื่ออาหาร',
+    'malaise': 'รู้สึกไม่สบายตัว',
+
+    # ระบบทางเดินหายใจ
+    'cough': 'ไอ',
+    'shortness_breath': 'หายใจลำบาก',
+    'runny_nose': 'น้ำมูกไหล',
+    'sneezing': 'จาม',
+    'sore_throat': 'เจ็บคอ',
+    'nasal_congestion': 'คัดจมูก',
+    'chest_pain': 'เจ็บหน้าอก',
+    'wheezing': 'หายใจมีเสียงหวีด',
+    'rapid_breathing': 'หายใจเร็ว',
+    'coughing_blood': 'ไอเป็นเลือด',
+
+    # ระบบทางเดินอาหาร
+    'nausea': 'คลื่นไส้',
+    'vomiting': 'อาเจียน',
+    'diarrhea': 'ท้องเสีย',
+    'constipation': 'ท้องผูก',
+    'stomach_pain': 'ปวดท้อง',
+    'bloating': 'ท้องอืด',
+    'heartburn': 'แสบร้อนกลางอก',
+    'abdominal_pain': 'ปวดท้องน้อย',
+    'bloody_stool': 'อุจจาระมีเลือดปน',
+    'excessive_gas': 'มีแก๊สในท้องมาก',
+
+    # ระบบประสาทและสมอง
+    'headache': 'ปวดศีรษะ',
+    'dizziness': 'วิงเวียน',
+    'confusion': 'สับสน',
+    'memory_problems': 'ความจำไม่ดี',
+    'seizures': 'ชัก',
+    'tremors': 'มือสั่น',
+    'difficulty_speaking': 'พูดลำบาก',
+    'difficulty_walking': 'เดินลำบาก',
+    'numbness': 'ชา',
+    'tingling': 'รู้สึกเหมือนเข็มทิ่ม',
+
+    # ระบบกล้ามเนื้อและกระดูก
+    'joint_pain': 'ปวดข้อ',
+    'muscle_pain': 'ปวดกล้ามเนื้อ',
+    'back_pain': 'ปวดหลัง',
+    'neck_pain': 'ปวดคอ',
+    'stiffness': 'ข้อฝืด',
+    'swelling': 'บวม',
+    'muscle_weakness': 'กล้ามเนื้ออ่อนแรง',
+    'muscle_cramps': 'ตะคริว',
+    'joint_stiffness': 'ข้อติด',
+    'bone_pain': 'ปวดกระดูก',
+
+    # ผิวหนังและเยื่อบุ
+    'rash': 'ผื่น',
+    'itching': 'คัน',
+    'skin_changes': 'ผิวหนังเปลี่ยนแปลง',
+    'bruising': 'จ้ำเลือด',
+    'dry_skin': 'ผิวแห้ง',
+    'excessive_sweating': 'เหงื่อออกมาก',
+    'pale_skin': 'ผิวซีด',
+    'yellow_skin': 'ผิวเหลือง',
+    'skin_pain': 'ผิวหนังเจ็บ',
+    'hair_loss': 'ผมร่วง',
+
+    # ตา หู คอ จมูก
+    'vision_problems': 'ปัญหาการมองเห็น',
+    'hearing_problems': 'ปัญหาการได้ยิน',
+    'ear_pain': 'ปวดหู',
+    'ringing_ears': 'หูอื้อ',
+    'eye_pain': 'ปวดตา',
+    'watery_eyes': 'น้ำตาไหล',
+    'red_eyes': 'ตาแดง',
+    'sinus_pressure': 'แน่นไซนัส',
+    'nose_bleeds': 'เลือดกำเดาไหล',
+    'hoarseness': 'เสียงแหบ',
+
+    # ระบบหัวใจและหลอดเลือด
+    'chest_pain_heart': 'เจ็บหน้าอกจากหัวใจ',
+    'palpitations': 'ใจสั่น',
+    'irregular_heartbeat': 'หัวใจเต้นผิดจังหวะ',
+    'high_blood_pressure': 'ความดันโลหิตสูง',
+    'low_blood_pressure': 'ความดันโลหิตต่ำ',
+    'swelling_legs': 'ขาบวม',
+    'cold_hands_feet': 'มือเท้าเย็น',
+    'varicose_veins': 'เส้นเลือดขอด',
+    'fainting': 'เป็นลม',
+    'bluish_skin': 'ผิวเขียวคล้ำ',
+
+    # อาการเกี่ยวกับการนอน
+    'insomnia': 'นอนไม่หลับ',
+    'sleep_too_much': 'นอนมากผิดปกติ',
+    'sleep_apnea': 'หยุดหายใจขณะนอนหลับ',
+    'snoring': 'นอนกรน',
+    'nightmares': 'ฝันร้าย',
+    'sleepwalking': 'ละเมอเดิน',
+
+    # อาการเกี่ยวกับอารมณ์และจิตใจ
+    'anxiety': 'วิตกกังวล',
+    'depression': 'ซึมเศร้า',
+    'mood_swings': 'อารมณ์แปรปรวน',
+    'irritability': 'หงุดหงิดง่าย',
+    'panic_attacks': 'อาการตื่นตระหนก',
+    'loss_of_interest': 'ไม่สนใจสิ่งรอบตัว',
+    'hopelessness': 'รู้สึกสิ้นหวัง',
+
+    # อาการระบบฮอร์โมน
+    'thyroid_problems': 'ปัญหาต่อมไทรอยด์',
+    'hot_flashes': 'ร้อนวูบวาบ',
+    'excessive_thirst': 'กระหายน้ำมาก',
+    'frequent_urination': 'ปัสสาวะบ่อย',
+    'menstrual_changes': 'ประจำเดือนผิดปกติ',
+    'erectile_dysfunction': 'ปัญหาการแข็งตัว',
+    'breast_changes': 'การเปลี่ยนแปลงของเต้านม',
+
+    # อาการระบบภูมิคุ้มกัน
+    'frequent_infections': 'ติดเชื้อง่าย',
+    'slow_healing': 'แผลหายช้า',
+    'autoimmune_symptoms': 'อาการภูมิต้านตัวเอง',
+    'allergic_reactions': 'อาการแพ้',
+    'lymph_node_swelling': 'ต่อมน้ำเหลืองบวม',
+    'immune_weakness': 'ภูมิคุ้มกันอ่อนแอ',
+    
+    # อาการเกี่ยวกับช่องปากและฟัน
+    'tooth_pain': 'ปวดฟัน',
+    'bleeding_gums': 'เหงือกเลือดออก',
+    'mouth_ulcers': 'แผลในปาก',
+    'bad_breath': 'กลิ่นปาก',
+    'dry_mouth': 'ปากแห้ง',
+    'teeth_grinding': 'นอนกัดฟัน',
+    'difficulty_swallowing': 'กลืนลำบาก',
+}
+
+# ชื่ออาการภาษาอังกฤษสร้างจากรหัสอาการ
+SYMPTOM_LABELS_EN = {code: code.replace('_', ' ') for code in SYMPTOM_LABELS}
+
+# ดัชนีสำหรับค้นหา/autocomplete อาการ
+symptom_index = SymptomIndex({'th': SYMPTOM_LABELS, 'en': SYMPTOM_LABELS_EN})
+
 def translate_symptom(symptom_code):
-    symptoms_dict = {
-        # อาการทั่วไป
-        'fever': 'มีไข้',
-        'fatigue': 'อ่อนเพลีย',
-        'weakness': 'อ่อนแรง',
-        'body_ache': 'ปวดเมื่อยตามตัว',
-        'night_sweats': 'เหงื่อออกตอนกลางคืน',
-        'weight_loss': 'น้ำหนักลด',
-        'weight_gain': 'น้ำหนักเพิ่ม',
-        'chills': 'หนาวสั่น',
-        'poor_appetite': 'เบื่ออาหาร',
-        'malaise': 'รู้สึกไม่สบายตัว',
-
-        # ระบบทางเดินหายใจ
-        'cough': 'ไอ',
-        'shortness_breath': 'หายใจลำบาก',
-        'runny_nose': 'น้ำมูกไหล',
-        'sneezing': 'จาม',
-        'sore_throat': 'เจ็บคอ',
-        'nasal_congestion': 'คัดจมูก',
-        'chest_pain': 'เจ็บหน้าอก',
-        'wheezing': 'หายใจมีเสียงหวีด',
-        'rapid_breathing': 'หายใจเร็ว',
-        'coughing_blood': 'ไอเป็นเลือด',
-
-        # ระบบทางเดินอาหาร
-        'nausea': 'คลื่นไส้',
-        'vomiting': 'อาเจียน',
-        'diarrhea': 'ท้องเสีย',
-        'constipation': 'ท้องผูก',
-        'stomach_pain': 'ปวดท้อง',
-        'bloating': 'ท้องอืด',
-        'heartburn': 'แสบร้อนกลางอก',
-        'abdominal_pain': 'ปวดท้องน้อย',
-        'bloody_stool': 'อุจจาระมีเลือดปน',
-        'excessive_gas': 'มีแก๊สในท้องมาก',
-
-        # ระบบประสาทและสมอง
-        'headache': 'ปวดศีรษะ',
-        'dizziness': 'วิงเวียน',
-        'confusion': 'สับสน',
-        'memory_problems': 'ความจำไม่ดี',
-        'seizures': 'ชัก',
-        'tremors': 'มือสั่น',
-        'difficulty_speaking': 'พูดลำบาก',
-        'difficulty_walking': 'เดินลำบาก',
-        'numbness': 'ชา',
-        'tingling': 'รู้สึกเหมือนเข็มทิ่ม',
-
-        # ระบบกล้ามเนื้อและกระดูก
-        'joint_pain': 'ปวดข้อ',
-        'muscle_pain': 'ปวดกล้ามเนื้อ',
-        'back_pain': 'ปวดหลัง',
-        'neck_pain': 'ปวดคอ',
-        'stiffness': 'ข้อฝืด',
-        'swelling': 'บวม',
-        'muscle_weakness': 'กล้ามเนื้ออ่อนแรง',
-        'muscle_cramps': 'ตะคริว',
-        'joint_stiffness': 'ข้อติด',
-        'bone_pain': 'ปวดกระดูก',
-
-        # ผิวหนังและเยื่อบุ
-        'rash': 'ผื่น',
-        'itching': 'คัน',
-        'skin_changes': 'ผิวหนังเปลี่ยนแปลง',
-        'bruising': 'จ้ำเลือด',
-        'dry_skin': 'ผิวแห้ง',
-        'excessive_sweating': 'เหงื่อออกมาก',
-        'pale_skin': 'ผิวซีด',
-        'yellow_skin': 'ผิวเหลือง',
-        'skin_pain': 'ผิวหนังเจ็บ',
-        'hair_loss': 'ผมร่วง',
-
-        # ตา หู คอ จมูก
-        'vision_problems': 'ปัญหาการมองเห็น',
-        'hearing_problems': 'ปัญหาการได้ยิน',
-        'ear_pain': 'ปวดหู',
-        'ringing_ears': 'หูอื้อ',
-        'eye_pain': 'ปวดตา',
-        'watery_eyes': 'น้ำตาไหล',
-        'red_eyes': 'ตาแดง',
-        'sinus_pressure': 'แน่นไซนัส',
-        'nose_bleeds': 'เลือดกำเดาไหล',
-        'hoarseness': 'เสียงแหบ',
-
-        # ระบบหัวใจและหลอดเลือด
-        'chest_pain_heart': 'เจ็บหน้าอกจากหัวใจ',
-        'palpitations': 'ใจสั่น',
-        'irregular_heartbeat': 'หัวใจเต้นผิดจังหวะ',
-        'high_blood_pressure': 'ความดันโลหิตสูง',
-        'low_blood_pressure': 'ความดันโลหิตต่ำ',
-        'swelling_legs': 'ขาบวม',
-        'cold_hands_feet': 'มือเท้าเย็น',
-        'varicose_veins': 'เส้นเลือดขอด',
-        'fainting': 'เป็นลม',
-        'bluish_skin': 'ผิวเขียวคล้ำ',
-
-        # อาการเกี่ยวกับการนอน
-        'insomnia': 'นอนไม่หลับ',
-        'sleep_too_much': 'นอนมากผิดปกติ',
-        'sleep_apnea': 'หยุดหายใจขณะนอนหลับ',
-        'snoring': 'นอนกรน',
-        'nightmares': 'ฝันร้าย',
-        'sleepwalking': 'ละเมอเดิน',
-
-        # อาการเกี่ยวกับอารมณ์และจิตใจ
-        'anxiety': 'วิตกกังวล',
-        'depression': 'ซึมเศร้า',
-        'mood_swings': 'อารมณ์แปรปรวน',
-        'irritability': 'หงุดหงิดง่าย',
-        'panic_attacks': 'อาการตื่นตระหนก',
-        'loss_of_interest': 'ไม่สนใจสิ่งรอบตัว',
-        'hopelessness': 'รู้สึกสิ้นหวัง',
-
-        # อาการระบบฮอร์โมน
-        'thyroid_problems': 'ปัญหาต่อมไทรอยด์',
-        'hot_flashes': 'ร้อนวูบวาบ',
-        'excessive_thirst': 'กระหายน้ำมาก',
-        'frequent_urination': 'ปัสสาวะบ่อย',
-        'menstrual_changes': 'ประจำเดือนผิดปกติ',
-        'erectile_dysfunction': 'ปัญหาการแข็งตัว',
-        'breast_changes': 'การเปลี่ยนแปลงของเต้านม',
-
-        # อาการระบบภูมิคุ้มกัน
-        'frequent_infections': 'ติดเชื้อง่าย',
-        'slow_healing': 'แผลหายช้า',
-        'autoimmune_symptoms': 'อาการภูมิต้านตัวเอง',
-        'allergic_reactions': 'อาการแพ้',
-        'lymph_node_swelling': 'ต่อมน้ำเหลืองบวม',
-        'immune_weakness': 'ภูมิคุ้มกันอ่อนแอ',
-        
-        # อาการเกี่ยวกับช่องปากและฟัน
-        'tooth_pain': 'ปวดฟัน',
-        'bleeding_gums': 'เหงือกเลือดออก',
-        'mouth_ulcers': 'แผลในปาก',
-        'bad_breath': 'กลิ่นปาก',
-        'dry_mouth': 'ปากแห้ง',
-        'teeth_grinding': 'นอนกัดฟัน',
-        'difficulty_swallowing': 'กลืนลำบาก',
-    }
-    return symptoms_dict.get(symptom_code, symptom_code)
+    return SYMPTOM_LABELS.get(symptom_code, symptom_code)
 
 @app.template_filter('translate_symptom')
 def translate_symptom_filter(symptom_code):
@@ -416,6 +446,169 @@ class Consultation(db.Model):
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# ดัชนีค้นหากรณีที่มีอาการคล้ายกัน (MinHash/LSH) โหลดจากดิสก์ตอนเริ่ม
+# ไฟล์ index สร้าง/อัปเดตนอก request: `flask build-similar-cases` หรือใน gunicorn master (when_ready)
+# ควรตั้ง cron ให้อัปเดตไฟล์เป็นระยะ เช่น
+#   */10 * * * * cd /path/to/app && flask --app app build-similar-cases
+# worker ที่ fork ใหม่ (รวมถึงที่ถูก restart ตาม max_requests) จะโหลดไฟล์ที่ใหม่กว่าเอง (reload_similar_cases)
+SIMILAR_CASES_PATH = os.environ.get(
+    'SIMILAR_CASES_PATH',
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'similar_cases.idx')
+)
+# จำนวนแถวสูงสุดที่ request หนึ่งเพิ่มเข้า index ได้
+SIMILAR_CASES_SYNC_LIMIT = int(os.environ.get('SIMILAR_CASES_SYNC_LIMIT', 200))
+# index เฉพาะรหัสอาการที่ระบบรู้จัก (รายการอาการ + อาการของแต่ละโรค) ไม่ใช่ค่าใดๆ ที่ส่งมาจากฟอร์ม
+SIMILAR_CASES_VOCABULARY = list(SYMPTOM_LABELS) + [
+    code for disease in get_diseases().values() for code in disease['symptoms']
+]
+if app.config['SIMILAR_CASES_ENABLED']:
+    similar_case_index = SimilarCaseIndex.load(SIMILAR_CASES_PATH, vocabulary=SIMILAR_CASES_VOCABULARY)
+else:
+    similar_case_index = SimilarCaseIndex(SIMILAR_CASES_VOCABULARY)
+similar_cases_sync_lock = threading.Lock()
+similar_cases_behind_warned = False
+
+def save_similar_cases():
+    try:
+        os.makedirs(os.path.dirname(SIMILAR_CASES_PATH), exist_ok=True)
+        similar_case_index.save(SIMILAR_CASES_PATH)
+    except OSError as e:
+        app.logger.warning(f"Could not save similar case index: {str(e)}")
+
+def reload_similar_cases():
+    """Load the index file if it is newer than the index in memory
+
+    Called in each gunicorn worker after fork (post_fork), so workers started
+    after a `flask build-similar-cases` run pick up the new file instead of
+    the master's copy from startup.
+
+    Returns:
+        bool: True if the index was replaced
+    """
+    global similar_case_index
+    if not app.config['SIMILAR_CASES_ENABLED']:
+        return False
+    try:
+        mtime = os.path.getmtime(SIMILAR_CASES_PATH)
+    except OSError:
+        return False
+    if similar_case_index.mtime is not None and mtime <= similar_case_index.mtime:
+        return False
+    index = SimilarCaseIndex.load(SIMILAR_CASES_PATH, vocabulary=SIMILAR_CASES_VOCABULARY)
+    # ไฟล์เสีย/คนละเวอร์ชัน หรือเก่ากว่าข้อมูลที่มีอยู่แล้ว ใช้ index เดิมต่อ
+    if index.mtime is None or index.last_id < similar_case_index.last_id:
+        return False
+    similar_case_index = index
+    return True
+
+def sync_similar_cases(limit=None, batch_size=5000):
+    """Add consultations inserted since the last sync (by any worker) to the index
+
+    Args:
+        limit (int): Maximum number of new rows to add, or None for all of them
+        batch_size (int): Number of rows fetched per query
+
+    Returns:
+        bool: True if the index has caught up with the database
+    """
+    # ถ้ามี thread อื่นกำลัง sync อยู่ ใช้ข้อมูลเท่าที่มีไปก่อน
+    if not similar_cases_sync_lock.acquire(blocking=False):
+        return True
+    try:
+        # id ที่ถูกข้ามไป (transaction ที่ commit ช้ากว่า id ที่มากกว่า) ตรวจซ้ำทุกครั้งที่ sync
+        gaps = similar_case_index.pending_gaps()
+        if gaps:
+            rows = db.session.query(Consultation.id, Consultation.symptoms) \
+                .filter(Consultation.id.in_(gaps)).all()
+            for case_id, symptoms in rows:
+                similar_case_index.add(case_id, fromjson_filter(symptoms))
+        added = 0
+        while True:
+            size = batch_size if limit is None else min(batch_size, limit - added)
+            if size <= 0:
+                return False
+            rows = db.session.query(Consultation.id, Consultation.symptoms) \
+                .filter(Consultation.id > similar_case_index.last_id) \
+                .order_by(Consultation.id).limit(size).all()
+            for case_id, symptoms in rows:
+                similar_case_index.add(case_id, fromjson_filter(symptoms))
+            added += len(rows)
+            if len(rows) < size:
+                return True
+    finally:
+        similar_cases_sync_lock.release()
+
+def build_similar_cases():
+    """Bring the similar case index up to date with the database and save it
+
+    Runs outside request handling: from `flask build-similar-cases`, from the
+    gunicorn master before workers are forked, or at startup of `python app.py`.
+    Does nothing while SIMILAR_CASES_ENABLED is off. If the database cannot be
+    reached the error is logged and the loaded (or empty) index is kept unsaved.
+    """
+    if not app.config['SIMILAR_CASES_ENABLED']:
+        return 0
+    with app.app_context():
+        try:
+            sync_similar_cases()
+        except SQLAlchemyError as e:
+            # ฐานข้อมูลยังไม่พร้อม: เริ่มด้วย index ที่โหลดไว้ (หรือว่าง) แล้วให้ request ตามเพิ่มทีละน้อย
+            db.session.rollback()
+            app.logger.error(f"Similar case index build error: {str(e)}")
+            return len(similar_case_index)
+    save_similar_cases()
+    return len(similar_case_index)
+
+@app.cli.command('build-similar-cases')
+def build_similar_cases_command():
+    """Build or update the similar case index file.
+
+    Run it periodically (e.g. from cron); running workers keep their index,
+    workers forked afterwards load the new file.
+    """
+    total = build_similar_cases()
+    print(f"Similar case index: {total} consultations -> {SIMILAR_CASES_PATH}")
+
+def can_view_similar_cases():
+    """Only clinicians may see other patients' consultations"""
+    return (app.config['SIMILAR_CASES_ENABLED']
+            and current_user.is_authenticated
+            and current_user.username in app.config['CLINICIAN_USERNAMES'])
+
+def find_similar_cases(symptoms, k=5, exclude=None, min_similarity=0.3):
+    """Return past consultations with similar symptoms, most similar first"""
+    try:
+        global similar_cases_behind_warned
+        # request เพิ่มได้ครั้งละไม่กี่แถว การสร้าง index ทั้งหมดทำนอก request (build_similar_cases)
+        if not sync_similar_cases(limit=SIMILAR_CASES_SYNC_LIMIT) and not similar_cases_behind_warned:
+            similar_cases_behind_warned = True
+            app.logger.warning("Similar case index is behind the database; schedule "
+                               "`flask build-similar-cases` (e.g. cron) so new workers "
+                               "load an up-to-date index")
+        matches = similar_case_index.query(symptoms, k=k, exclude=exclude,
+                                           min_similarity=min_similarity)
+        if not matches:
+            return []
+        cases = {c.id: c for c in Consultation.query.filter(
+            Consultation.id.in_([case_id for case_id, _ in matches])).all()}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Similar case lookup error: {str(e)}")
+        return []
+
+    similar_cases = []
+    for case_id, similarity in matches:
+        case = cases.get(case_id)
+        if case is None:
+            continue
+        similar_cases.append({
+            'similarity': round(similarity, 2),
+            'symptoms': fromjson_filter(case.symptoms),
+            'diagnosis': fromjson_filter(case.diagnosis),
+            'recommendation': case.recommendation
+        })
+    return similar_cases
+
 # Routes
 @app.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -597,7 +790,14 @@ def symptom_checker():
             recommendation=recommendation
         )
         db.session.add(consultation)
-        db.session.commit()        # ดึงข้อมูลการแพ้ยาและโรคประจำตัว
+        db.session.commit()
+
+        # ค้นหากรณีในอดีตที่มีอาการคล้ายกัน (ไม่รวมการตรวจครั้งนี้) เฉพาะแพทย์
+        similar_cases = []
+        if can_view_similar_cases():
+            similar_cases = find_similar_cases(symptoms, exclude=consultation.id)
+
+        # ดึงข้อมูลการแพ้ยาและโรคประจำตัว
         health_conditions = current_user.health_conditions or "ไม่มี"
         drug_allergies = current_user.drug_allergies or "ไม่มี"
         
@@ -606,10 +806,35 @@ def symptom_checker():
                             recommendation=recommendation,
                             bmi=bmi,
                             health_conditions=health_conditions,
-                            drug_allergies=drug_allergies)
+                            drug_allergies=drug_allergies,
+                            similar_cases=similar_cases)
 
     return render_template('symptom_checker.html')
 
+@app.route('/api/symptoms/search')
+@login_required
+def symptom_search():
+    query = request.args.get('q', '')
+    locale = request.args.get('locale', 'th')
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    results = symptom_index.search(query, limit=limit, locale=locale)
+    return jsonify({"query": query, "results": results}), 200
+
+@app.route('/api/similar_cases')
+@login_required
+def similar_cases_api():
+    if not can_view_similar_cases():
+        return jsonify({"error": "forbidden"}), 403
+    symptoms = request.args.getlist('symptoms')
+    try:
+        k = min(max(int(request.args.get('k', 5)), 1), 50)
+    except ValueError:
+        k = 5
+    return jsonify({"symptoms": symptoms, "cases": find_similar_cases(symptoms, k=k)}), 200
+
 @app.route('/forgot_password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':
@@ -634,7 +859,10 @@ def internal_error(error):
 
 @app.route('/health')
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    health = {"status": "healthy"}
+    if log_pipeline is not None:
+        health["logging"] = log_pipeline.stats()
+    return jsonify(health), 200
 
 def init_db(max_retries=3, retry_delay=5):
     """Initialize database with retry mechanism
@@ -683,6 +911,9 @@ if __name__ == '__main__':
         if not init_db():
             app.logger.error("Failed to initialize database. Exiting...")
             exit(1)
+
+        # สร้าง/อัปเดต index กรณีที่คล้ายกันก่อนเริ่มรับ request
+        build_similar_cases()
         
         # Get port from environment or use default
         port = int(os.environ.get('PORT', 5000))
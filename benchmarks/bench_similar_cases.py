@@ -0,0 +1,127 @@
+"""Benchmark: MinHash/LSH similar-case search vs exact Jaccard search
+
+Generates synthetic consultations (symptom sets drawn around disease
+profiles; the defaults match the app: 16 diseases of 5 symptoms over 119
+symptom codes), then compares query latency and recall@k of
+SimilarCaseIndex.query() against brute-force SimilarCaseIndex.exact_query().
+Also reports recall at the app's similarity threshold: the fraction of all
+cases with Jaccard >= --min-similarity that the LSH query returns.
+
+    python benchmarks/bench_similar_cases.py --cases 300000 --queries 200
+
+``--max-bucket-scan`` bounds how many distinct symptom sets are read per
+bucket; lowering it trades recall at the threshold for latency.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similar_cases import SimilarCaseIndex
+
+
+def make_cases(count, vocabulary, profiles, rng):
+    for case_id in range(1, count + 1):
+        profile = rng.choice(profiles)
+        symptoms = set(rng.sample(profile, rng.randint(2, len(profile))))
+        if rng.random() < 0.5:
+            symptoms.add(rng.choice(vocabulary))
+        yield case_id, sorted(symptoms)
+
+
+def recall_at_k(approx, exact):
+    """Fraction of the exact top-k similarity scores matched by the approximate results"""
+    if not exact:
+        return 1.0
+    cutoff = exact[-1][1]
+    hits = sum(1 for _, similarity in approx if similarity >= cutoff)
+    return min(hits, len(exact)) / len(exact)
+
+
+def threshold_recall(approx, exact):
+    """Fraction of the cases at or above the threshold that were retrieved"""
+    if not exact:
+        return None
+    found = {case_id for case_id, _ in approx}
+    return sum(1 for case_id, _ in exact if case_id in found) / len(exact)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--min-similarity', type=float, default=0.3)
+    parser.add_argument('--max-bucket-scan', type=int, default=1000)
+    parser.add_argument('--vocabulary', type=int, default=119)
+    parser.add_argument('--profiles', type=int, default=16)
+    parser.add_argument('--profile-size', type=int, default=5)
+    parser.add_argument('--num-perm', type=int, default=64)
+    parser.add_argument('--bands', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = ['symptom_%d' % i for i in range(args.vocabulary)]
+    profiles = [rng.sample(vocabulary, args.profile_size) for _ in range(args.profiles)]
+
+    index = SimilarCaseIndex(vocabulary, num_perm=args.num_perm, bands=args.bands,
+                             max_bucket_scan=args.max_bucket_scan)
+    started = time.perf_counter()
+    for case_id, symptoms in make_cases(args.cases, vocabulary, profiles, rng):
+        index.add(case_id, symptoms)
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'similar_cases.idx')
+        started = time.perf_counter()
+        index.save(path)
+        save_seconds = time.perf_counter() - started
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        started = time.perf_counter()
+        SimilarCaseIndex.load(path, vocabulary, num_perm=args.num_perm, bands=args.bands)
+        load_seconds = time.perf_counter() - started
+
+    queries = [symptoms for _, symptoms in make_cases(args.queries, vocabulary, profiles, rng)]
+    lsh_times, exact_times, recalls, threshold_recalls = [], [], [], []
+    for symptoms in queries:
+        started = time.perf_counter()
+        approx = index.query(symptoms, k=args.k, min_similarity=args.min_similarity)
+        lsh_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        exact = index.exact_query(symptoms, k=args.k, min_similarity=args.min_similarity)
+        exact_times.append(time.perf_counter() - started)
+        recalls.append(recall_at_k(approx, exact))
+        recall = threshold_recall(
+            index.query(symptoms, k=None, min_similarity=args.min_similarity),
+            index.exact_query(symptoms, k=None, min_similarity=args.min_similarity))
+        if recall is not None:
+            threshold_recalls.append(recall)
+
+    print('cases=%d queries=%d k=%d num_perm=%d bands=%d min_similarity=%.2f'
+          % (args.cases, args.queries, args.k, args.num_perm, args.bands, args.min_similarity))
+    print('symptom sets %d (distinct) for %d cases' % (len(index.sets), len(index)))
+    print('build  %.2fs (%.1f us/case)' % (build_seconds, build_seconds / args.cases * 1e6))
+    print('save   %.2fs  load %.2fs  size %.1f MB' % (save_seconds, load_seconds, size_mb))
+    for name, times in (('lsh', lsh_times), ('exact', exact_times)):
+        print('%-6s mean %8.3f ms  p95 %8.3f ms'
+              % (name, statistics.mean(times) * 1000, percentile(times, 0.95) * 1000))
+    print('speedup %.1fx  recall@%d %.3f'
+          % (statistics.mean(exact_times) / statistics.mean(lsh_times), args.k,
+             statistics.mean(recalls)))
+    print('recall(similarity >= %.2f) %.3f'
+          % (args.min_similarity, statistics.mean(threshold_recalls) if threshold_recalls else 1.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Benchmark: gunicorn sync workers vs gthread workers at the same worker count
+
+Starts the app under gunicorn with the repo's gunicorn_config.py (preload,
+post_fork engine dispose, pool sizing) twice with the same number of worker
+processes (so roughly the same memory), once with ``sync`` and once with
+``gthread``, and drives ``POST /login`` (one user lookup per request) from concurrent
+clients. Every SQL statement sleeps ``--db-latency`` seconds to stand in for
+the round trip to Postgres. Reports throughput, latency and total RSS.
+
+    python benchmarks/bench_workers.py --workers 2 --threads 4 --clients 32
+
+Linux only (RSS is read from /proc). Requires gunicorn and the app's
+requirements.
+
+When gunicorn imports this module as ``bench_workers:app`` it serves the
+real app on a throwaway SQLite database with the simulated latency.
+"""
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _build_app():
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import event
+
+    from app import app, db
+
+    latency = float(os.environ['BENCH_DB_LATENCY'])
+    with app.app_context():
+        db.create_all()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def simulate_latency(*args):
+            time.sleep(latency)
+
+    return app
+
+
+if 'BENCH_DB_LATENCY' in os.environ:
+    app = _build_app()
+
+
+def rss_kb(pid):
+    """Resident memory of a process and all its children"""
+    total = 0
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return total
+    return total + sum(rss_kb(child) for child in children)
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start on port %d' % port)
+
+
+def drive(port, clients, duration):
+    body = urllib.parse.urlencode({'username': 'nobody', 'password': 'secret'})
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        local = []
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                conn.request('POST', '/login', body, headers)
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                if response.status != 200:
+                    raise OSError(response.status)
+                local.append(time.perf_counter() - started)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def run(mode, args, port, directory):
+    env = dict(os.environ,
+               GUNICORN_WORKER_CLASS=mode,
+               WEB_CONCURRENCY=str(args.workers),
+               BENCH_DB_LATENCY=str(args.db_latency),
+               DATABASE_URL='sqlite:///' + os.path.join(directory, '%s.db' % mode),
+               LOG_FILE=os.path.join(directory, '%s.log' % mode),
+               SIMILAR_CASES_PATH=os.path.join(directory, '%s.idx' % mode))
+    env.pop('GUNICORN_THREADS', None)
+    if mode == 'gthread':
+        env['GUNICORN_THREADS'] = str(args.threads)
+    # bind ใน config ใช้ $PORT จึงกำหนด -b เอง ส่วนค่าอื่นมาจาก gunicorn_config.py
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+               '--chdir', os.path.dirname(os.path.abspath(__file__)),
+               '-b', '127.0.0.1:%d' % port, '--access-logfile', '/dev/null',
+               '--log-level', 'warning', 'bench_workers:app']
+    server = subprocess.Popen(command, env=env)
+    try:
+        wait_ready(port)
+        drive(port, args.clients, 1)  # warm-up
+        latencies, errors = drive(port, args.clients, args.duration)
+        memory = rss_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    return {
+        'rps': len(latencies) / args.duration,
+        'p50': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p95': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        'mean': statistics.mean(latencies) * 1000 if latencies else 0,
+        'errors': errors,
+        'rss_mb': memory / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--db-latency', type=float, default=0.005)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    print('workers=%d threads=%d clients=%d duration=%ss db_latency=%sms'
+          % (args.workers, args.threads, args.clients, args.duration, args.db_latency * 1000))
+    with tempfile.TemporaryDirectory() as directory:
+        for offset, mode in enumerate(('sync', 'gthread')):
+            result = run(mode, args, args.port + offset, directory)
+            print('%-8s %8.1f req/s  mean %7.1f ms  p50 %7.1f ms  p95 %7.1f ms  '
+                  'rss %6.1f MB  errors %d'
+                  % (mode, result['rps'], result['mean'], result['p50'], result['p95'],
+                     result['rss_mb'], result['errors']))
+
+
+if __name__ == '__main__':
+    main()
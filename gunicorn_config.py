@@ -1,16 +1,24 @@
 import multiprocessing
+import os
 
 # Server socket configuration
 bind = "0.0.0.0:$PORT"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
+# gthread: แต่ละ worker รับหลาย request พร้อมกันด้วย thread pool
+# ระหว่างที่ thread หนึ่งรอ Postgres thread อื่นยังทำงานต่อได้ โดยใช้หน่วยความจำเท่ากับจำนวน worker เดิม
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# gunicorn เปลี่ยน sync เป็น gthread เองถ้า threads > 1 จึงใช้ 1 thread เมื่อเลือก sync
+threads = int(os.environ.get('GUNICORN_THREADS', 1 if worker_class == 'sync' else 4))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
 
+# ให้ app ตั้งขนาด connection pool ตามจำนวน thread ต่อ worker (ดู configure_database ใน app.py)
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+
 # Process naming
 proc_name = 'medical_app'
 
@@ -28,6 +36,22 @@ preload_app = True
 reload = False
 daemon = False
 
+def when_ready(server):
+    # preload_app=True: สร้าง/อัปเดต index กรณีที่คล้ายกันใน master ครั้งเดียวก่อน fork worker
+    # worker จึงได้ index ที่ครบแล้ว (copy-on-write) และ request ไม่ต้องสร้าง index เอง
+    from app import app, db, build_similar_cases
+    build_similar_cases()
+    with app.app_context():
+        db.engine.dispose()
+
+def post_fork(server, worker):
+    # preload_app=True: ห้าม worker ใช้ connection ที่ master เปิดค้างไว้ร่วมกัน
+    from app import app, db, reload_similar_cases
+    with app.app_context():
+        db.engine.dispose(close=False)
+    # worker ที่ถูก restart (max_requests) โหลดไฟล์ index ที่ cron อัปเดตแล้ว แทนสำเนาเก่าของ master
+    reload_similar_cases()
+
 # Server mechanics
 graceful_timeout = 30
 max_requests = 1000
@@ -0,0 +1,288 @@
+"""Non-blocking logging pipeline
+
+Request threads only put records on a bounded in-memory queue (records are
+dropped and counted when the queue is full), and a background thread writes
+them as JSON lines in batches to a file that rotates by size and by time.
+Rotation is coordinated through a lock file so that forked gunicorn workers
+can share one log file safely.
+"""
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows (waitress) ไม่มี fcntl
+    fcntl = None
+
+_STOP = object()
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a record as a single JSON line"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + '.%03dZ' % record.msecs,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+            'path': record.pathname,
+            'line': record.lineno,
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never waits: records are dropped when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        # แปลงข้อความใน thread ของ request แต่ไม่ต้อง format ทั้งบรรทัด
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+
+class SharedRotatingFile:
+    """Append-only log file rotated by size or time, safe across processes
+
+    Lines are appended with as few os.write() calls as possible on an
+    O_APPEND descriptor; a batch is split where it would cross ``max_bytes``
+    so the file is rotated between lines. Before writing, the path is
+    re-checked so that a process notices when another worker has already
+    rotated the file and reopens it.
+
+    ``max_bytes`` is approximate when several processes share the file: each
+    checks the size before its own write, so concurrent writers can each add
+    one chunk past the cap before one of them rotates.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, rotate_interval=86400,
+                 backup_count=10):
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.fd = None
+        self.period = None
+        self.open()
+
+    def open(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        st = os.fstat(self.fd)
+        # ใช้เวลาแก้ไขล่าสุดของไฟล์ เพื่อให้ worker ที่เพิ่งเริ่มยังหมุนไฟล์ตามรอบเวลาเดิม
+        opened = st.st_mtime if st.st_size else time.time()
+        self.period = self._period(opened)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def write(self, lines):
+        """Append encoded lines (bytes, each ending with a newline)"""
+        if not self._is_current():
+            self.open()
+        size = os.fstat(self.fd).st_size
+        chunk = []
+        chunk_size = 0
+        for line in lines:
+            if self._should_rotate(size + chunk_size, len(line)):
+                if chunk:
+                    os.write(self.fd, b''.join(chunk))
+                    chunk = []
+                    chunk_size = 0
+                self._rotate(len(line))
+                size = os.fstat(self.fd).st_size
+            chunk.append(line)
+            chunk_size += len(line)
+        if chunk:
+            os.write(self.fd, b''.join(chunk))
+
+    def _period(self, timestamp):
+        if not self.rotate_interval:
+            return 0
+        return int(timestamp // self.rotate_interval)
+
+    def _is_current(self):
+        try:
+            return os.stat(self.filename).st_ino == os.fstat(self.fd).st_ino
+        except OSError:
+            return False
+
+    def _should_rotate(self, size, incoming):
+        if self.backup_count <= 0:
+            return False
+        if self.max_bytes and size and size + incoming > self.max_bytes:
+            return True
+        return size > 0 and self._period(time.time()) > self.period
+
+    def _rotate(self, incoming):
+        lock_fd = os.open(self.filename + '.lock', os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            # worker อื่นอาจหมุนไฟล์ไปแล้วระหว่างรอ lock
+            if not self._is_current():
+                self.open()
+                return
+            if not self._should_rotate(os.fstat(self.fd).st_size, incoming):
+                return
+            # ปิดไฟล์ก่อน rename (Windows ไม่ยอมให้ rename ไฟล์ที่ยังเปิดอยู่)
+            self.close()
+            try:
+                for i in range(self.backup_count - 1, 0, -1):
+                    src = '%s.%d' % (self.filename, i)
+                    if os.path.exists(src):
+                        os.replace(src, '%s.%d' % (self.filename, i + 1))
+                os.replace(self.filename, self.filename + '.1')
+            except OSError as e:
+                # เช่น process อื่นบน Windows ยังเปิดไฟล์อยู่: หยุดหมุนไฟล์แทนการลองใหม่และทิ้ง log ทุก batch
+                self.backup_count = 0
+                sys.stderr.write('Log rotation disabled for %s: %s\n' % (self.filename, e))
+            finally:
+                self.open()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+
+class LogPipeline:
+    """Queue + background writer thread feeding a SharedRotatingFile
+
+    Attach ``pipeline.handler`` to a logger and call ``start()``. The writer
+    drains up to ``batch_size`` records per write and is restarted
+    automatically in forked child processes.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, rotate_interval=86400,
+                 backup_count=10, queue_size=10000, batch_size=256, flush_interval=1.0):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.formatter = JSONFormatter()
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        self.written = 0
+        self.errors = 0
+        self._file = None
+        self._thread = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._file = SharedRotatingFile(self.filename, self.max_bytes,
+                                        self.rotate_interval, self.backup_count)
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Flush queued records and stop the writer thread"""
+        if self._thread is None:
+            return
+        try:
+            self.handler.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return {
+            'queued': self.handler.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'written': self.written,
+            'errors': self.errors,
+        }
+
+    def _after_fork(self):
+        # thread ของ process แม่ไม่ถูกคัดลอกมา และ lock ใน queue เดิมอาจค้างอยู่
+        running = self._thread is not None
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        self.handler._drop_lock = threading.Lock()
+        self.written = 0
+        self.errors = 0
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if running:
+            self.start()
+
+    def _run(self):
+        log_queue = self.handler.queue
+        stopping = False
+        while not stopping:
+            try:
+                record = log_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = log_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                self.errors += 1
+        if not lines:
+            return
+        try:
+            self._file.write([(line + '\n').encode('utf-8') for line in lines])
+            self.written += len(lines)
+        except OSError:
+            self.errors += len(lines)
@@ -0,0 +1,261 @@
+"""Approximate similar-case search over consultation symptom sets
+
+Each consultation's symptoms are stored as an integer bitset, and
+consultations with the same bitset share one entry (a "symptom set"). A
+MinHash signature of each distinct set is split into LSH bands; sets sharing
+any band bucket become candidates, are re-ranked by exact Jaccard similarity
+and expanded to their most recent consultations. The index file is built
+offline and loaded at startup; workers only add the few rows inserted since.
+"""
+import os
+import pickle
+import random
+import tempfile
+import threading
+from array import array
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+_FORMAT_VERSION = 3
+
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:  # Python < 3.10
+    def _popcount(value):
+        return bin(value).count('1')
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two integer bitsets"""
+    union = a | b
+    if not union:
+        return 0.0
+    return _popcount(a & b) / _popcount(union)
+
+
+class SimilarCaseIndex:
+    """MinHash/LSH index over distinct symptom sets
+
+    ``num_perm`` hash functions are split into ``bands`` bands of
+    ``num_perm // bands`` rows; two sets with Jaccard similarity ``s`` share
+    at least one bucket with probability ``1 - (1 - s**rows)**bands``. The
+    default 32 bands x 2 rows gives about 0.95 at ``s = 0.3`` (the app's
+    ``min_similarity``); 16 x 4 gave only about 0.12.
+    Only codes in ``vocabulary`` are indexed; anything else is ignored.
+
+    Buckets hold symptom-set ids, and each set keeps its consultation ids in
+    an ``array('q')``, so memory per consultation is 8 bytes and a loaded
+    index has no per-consultation Python objects (nothing for refcounts to
+    touch after fork). ``max_bucket_scan`` bounds how many of the most recent
+    distinct sets are read from each bucket: with the app's 16 disease
+    profiles, 300k consultations form about 42k distinct sets and the default
+    1000 keeps recall at ``s >= 0.3`` near 0.97 (200 drops it to about 0.3);
+    see benchmarks/bench_similar_cases.py.
+
+    Ids skipped while moving ``last_id`` forward are kept in ``gaps`` (up to
+    ``gap_window`` ids behind ``last_id``): a transaction that commits after a
+    higher id is already indexed can still be picked up later.
+    """
+
+    def __init__(self, vocabulary=(), num_perm=64, bands=32, seed=1, max_bucket_scan=1000,
+                 gap_window=1000):
+        if num_perm % bands:
+            raise ValueError('num_perm must be divisible by bands')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seed = seed
+        self.max_bucket_scan = max_bucket_scan
+        self.gap_window = gap_window
+        rng = random.Random(seed)
+        self._hashes = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+                        for _ in range(num_perm)]
+        self._hash_rows = {}
+        self.positions = {}
+        for code in vocabulary:
+            self.positions.setdefault(code, len(self.positions))
+        self.sets = []        # bitset ของชุดอาการที่ไม่ซ้ำกัน (index = set id)
+        self.set_ids = {}     # bitset -> set id
+        self.cases = []       # array('q') ของ case id ในแต่ละชุดอาการ เรียงตามลำดับที่เพิ่ม
+        self.buckets = [{} for _ in range(bands)]
+        self.count = 0
+        self.last_id = 0
+        self.gaps = set()
+        self.mtime = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def to_bitset(self, symptoms):
+        # รหัสที่ไม่อยู่ใน vocabulary ถูกข้าม (อาการมาจากฟอร์มของผู้ใช้โดยตรง)
+        bitset = 0
+        for code in symptoms:
+            position = self.positions.get(code)
+            if position is not None:
+                bitset |= 1 << position
+        return bitset
+
+    def _band_keys(self, bitset):
+        bits = []
+        while bitset:
+            lowest = bitset & -bitset
+            bits.append(lowest.bit_length() - 1)
+            bitset ^= lowest
+        # ค่า hash ของแต่ละตำแหน่งคำนวณครั้งเดียวแล้วเก็บไว้ (จำนวนอาการมีจำกัด)
+        rows = []
+        for x in bits:
+            row = self._hash_rows.get(x)
+            if row is None:
+                row = self._hash_rows[x] = tuple((a * x + b) % _PRIME for a, b in self._hashes)
+            rows.append(row)
+        signature = rows[0] if len(rows) == 1 else list(map(min, *rows))
+        keys = []
+        for i in range(self.bands):
+            # รวมค่าในแต่ละ band เป็น key แบบคงที่ (ไม่ขึ้นกับ hash() ของแต่ละเวอร์ชัน Python)
+            key = i
+            for value in signature[i * self.rows:(i + 1) * self.rows]:
+                key = ((key * 1000003) ^ value) & _MASK
+            keys.append(key)
+        return keys
+
+    def add(self, case_id, symptoms):
+        """Index one consultation
+
+        Ids should arrive roughly in increasing order, since queries prefer
+        the most recently added consultations of each symptom set.
+        """
+        bitset = self.to_bitset(symptoms)
+        with self._lock:
+            if case_id > self.last_id:
+                self.gaps.update(range(max(self.last_id + 1, case_id - self.gap_window + 1), case_id))
+                self.last_id = case_id
+                if len(self.gaps) > 2 * self.gap_window:
+                    self._trim_gaps()
+            elif case_id in self.gaps:
+                self.gaps.discard(case_id)
+            else:
+                return  # เพิ่มไปแล้ว
+            if not bitset:
+                return
+            set_id = self.set_ids.get(bitset)
+            if set_id is None:
+                set_id = len(self.sets)
+                for band, key in zip(self.buckets, self._band_keys(bitset)):
+                    bucket = band.get(key)
+                    if bucket is None:
+                        bucket = band[key] = array('q')
+                    bucket.append(set_id)
+                self.cases.append(array('q'))
+                self.sets.append(bitset)
+                self.set_ids[bitset] = set_id
+            self.cases[set_id].append(case_id)
+            self.count += 1
+
+    def _trim_gaps(self):
+        oldest = self.last_id - self.gap_window
+        self.gaps = {case_id for case_id in self.gaps if case_id > oldest}
+
+    def pending_gaps(self):
+        """Ids below ``last_id`` that have not been seen yet (within ``gap_window``)"""
+        with self._lock:
+            self._trim_gaps()
+            return sorted(self.gaps)
+
+    def query(self, symptoms, k=5, exclude=None, min_similarity=0.0):
+        """Return up to ``k`` (all if None) ``(case_id, similarity)`` pairs, most similar first"""
+        bitset = self.to_bitset(symptoms)
+        if not bitset:
+            return []
+        keys = self._band_keys(bitset)
+        with self._lock:
+            candidates = set()
+            for band, key in zip(self.buckets, keys):
+                bucket = band.get(key)
+                if bucket:
+                    candidates.update(bucket[-self.max_bucket_scan:])
+        # คำนวณ Jaccard นอก lock (sets และ cases มีแต่เพิ่มต่อท้าย จึงอ่านพร้อมกับ add() ได้)
+        sets = self.sets
+        scored = [(jaccard(bitset, sets[set_id]), set_id) for set_id in candidates]
+        return self._expand(scored, k, exclude, min_similarity)
+
+    def exact_query(self, symptoms, k=5, exclude=None, min_similarity=0.0):
+        """Brute-force Jaccard search over every symptom set (for benchmarks and checks)"""
+        bitset = self.to_bitset(symptoms)
+        if not bitset:
+            return []
+        sets = self.sets[:]
+        scored = [(jaccard(bitset, other), set_id) for set_id, other in enumerate(sets)]
+        return self._expand(scored, k, exclude, min_similarity)
+
+    def _expand(self, scored, k, exclude, min_similarity):
+        """Turn ``(similarity, set_id)`` pairs into the most recent matching case ids"""
+        scored = [item for item in scored if item[0] > 0 and item[0] >= min_similarity]
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        results = []
+        for similarity, set_id in scored:
+            if k is not None and len(results) >= k and similarity < results[k - 1][1]:
+                break
+            case_ids = self.cases[set_id]
+            case_ids = case_ids[:] if k is None else case_ids[-(k + 1):]
+            results.extend((case_id, similarity) for case_id in case_ids if case_id != exclude)
+        results.sort(key=lambda item: (-item[1], -item[0]))
+        return results if k is None else results[:k]
+
+    def save(self, path):
+        """Write the index atomically (temp file + rename)
+
+        The state is copied under the lock and pickled outside it. ``mtime``
+        is set to the new file's, so the saved file is not reloaded as newer.
+        """
+        with self._lock:
+            state = {
+                'version': _FORMAT_VERSION,
+                'params': (self.num_perm, self.bands, self.seed),
+                'positions': dict(self.positions),
+                'sets': self.sets[:],
+                'cases': [case_ids[:] for case_ids in self.cases],
+                'buckets': [{key: bucket[:] for key, bucket in band.items()}
+                            for band in self.buckets],
+                'count': self.count,
+                'last_id': self.last_id,
+                'gaps': set(self.gaps),
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.similar_cases.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self.mtime = os.path.getmtime(path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, vocabulary=(), **kwargs):
+        """Load a saved index, or return an empty one if the file is missing or stale"""
+        index = cls(vocabulary, **kwargs)
+        try:
+            with open(path, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return index
+        if (state.get('version') != _FORMAT_VERSION
+                or tuple(state.get('params', ())) != (index.num_perm, index.bands, index.seed)):
+            return index
+        if any(index.positions.get(code) != position
+               for code, position in state['positions'].items()):
+            return index
+        index.sets = state['sets']
+        index.set_ids = {bitset: set_id for set_id, bitset in enumerate(index.sets)}
+        index.cases = state['cases']
+        index.buckets = state['buckets']
+        index.count = state['count']
+        index.last_id = state['last_id']
+        index.gaps = state['gaps']
+        index.mtime = mtime
+        return index
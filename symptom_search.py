@@ -0,0 +1,122 @@
+"""Prefix/fuzzy search over symptom codes and their localized labels
+
+The index is built once at startup. Prefix matches come from a sorted term
+list (binary search), substring and typo-tolerant matches from a character
+bigram index, which also works for Thai labels that have no word spaces.
+"""
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+_SPLIT = re.compile(r'[\s_\-/]+')
+
+# ลำดับความสำคัญของประเภทการจับคู่ (น้อย = ดีกว่า)
+EXACT, LABEL_PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+_MATCH_NAMES = {
+    EXACT: 'exact',
+    LABEL_PREFIX: 'prefix',
+    WORD_PREFIX: 'prefix',
+    SUBSTRING: 'substring',
+    FUZZY: 'fuzzy',
+}
+
+
+def normalize(text):
+    return ' '.join(_SPLIT.split(text.strip().lower()))
+
+
+def _bigrams(text):
+    padded = ' %s ' % text
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+class SymptomIndex:
+    """Search index over ``{locale: {code: label}}``
+
+    ``search()`` returns matches ranked by match type (exact, prefix,
+    substring, fuzzy), then by similarity and label length.
+    """
+
+    def __init__(self, labels_by_locale, fuzzy_threshold=0.45):
+        self.labels = {locale: dict(labels) for locale, labels in labels_by_locale.items()}
+        self.fuzzy_threshold = fuzzy_threshold
+        self._docs = []          # [(code, locale, normalized label)]
+        self._grams = []         # bigram set ของแต่ละ doc
+        self._postings = defaultdict(list)
+        terms = []
+        codes = set()
+        for labels in self.labels.values():
+            codes.update(labels)
+        for locale, labels in self.labels.items():
+            for code, label in labels.items():
+                self._add_doc(code, locale, normalize(label), terms)
+        for code in codes:
+            self._add_doc(code, None, normalize(code), terms)
+        terms.sort()
+        self._terms = [t[0] for t in terms]
+        self._term_docs = [(t[1], t[2]) for t in terms]
+
+    def _add_doc(self, code, locale, text, terms):
+        doc_id = len(self._docs)
+        self._docs.append((code, locale, text))
+        terms.append((text, doc_id, LABEL_PREFIX))
+        words = text.split(' ')
+        for i in range(1, len(words)):
+            terms.append((' '.join(words[i:]), doc_id, WORD_PREFIX))
+        grams = _bigrams(text)
+        self._grams.append(len(grams))
+        for gram in grams:
+            self._postings[gram].append(doc_id)
+
+    def search(self, query, limit=10, locale='th'):
+        query = normalize(query)
+        if not query:
+            return []
+        best = {}
+
+        def consider(doc_id, kind, similarity):
+            code, _, text = self._docs[doc_id]
+            key = (kind, -similarity, len(text))
+            if code not in best or key < best[code][0]:
+                best[code] = (key, kind)
+
+        # prefix ของ label หรือของคำใดคำหนึ่งใน label
+        start = bisect_left(self._terms, query)
+        for i in range(start, len(self._terms)):
+            if not self._terms[i].startswith(query):
+                break
+            doc_id, kind = self._term_docs[i]
+            if kind == LABEL_PREFIX and self._terms[i] == query:
+                kind = EXACT
+            consider(doc_id, kind, 1.0)
+
+        if len(query) < 2:
+            # คำค้นตัวอักษรเดียวไม่มี bigram ร่วมกับกลางคำ (เช่น "บ" ใน "หายใจลำบาก") จึงไล่หาทุก doc แทน
+            for doc_id, (_, _, text) in enumerate(self._docs):
+                if query in text:
+                    consider(doc_id, SUBSTRING, 1.0)
+        else:
+            # substring และ fuzzy จาก bigram ที่ตรงกัน
+            query_grams = _bigrams(query)
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for doc_id in self._postings.get(gram, ()):
+                    shared[doc_id] += 1
+            for doc_id, count in shared.items():
+                similarity = 2.0 * count / (len(query_grams) + self._grams[doc_id])
+                if query in self._docs[doc_id][2]:
+                    consider(doc_id, SUBSTRING, similarity)
+                elif len(query) >= 3 and similarity >= self.fuzzy_threshold:
+                    consider(doc_id, FUZZY, similarity)
+
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], item[0]))
+        return [self._result(code, kind, locale) for code, (key, kind) in ranked[:limit]]
+
+    def _result(self, code, kind, locale):
+        labels = {loc: names[code] for loc, names in self.labels.items() if code in names}
+        return {
+            'code': code,
+            'label': labels.get(locale, code),
+            'labels': labels,
+            'match': _MATCH_NAMES[kind],
+        }